@@ -2,15 +2,21 @@ from __future__ import annotations
 
 import asyncio
 import datetime as dt
-import json
+import sqlite3
+import threading
+import time
+from collections import deque
 from contextlib import suppress
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Deque, Dict, List, Literal, Optional, Sequence, Tuple
 
 import aiohttp
-import yaml
+import msgspec
+import msgspec.yaml
+import numpy as np
+import orjson
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
@@ -21,7 +27,9 @@ except Exception:  # pragma: no cover
 
 APP_DIR = Path(__file__).parent
 DATA_DIR = APP_DIR / "data"
-DATA_FILE = DATA_DIR / "checks.ndjson"
+DB_FILE = DATA_DIR / "checks.db"
+# file-based storage of older versions, imported into an empty database on startup
+LEGACY_DATA_FILE = DATA_DIR / "checks.ndjson"
 CONFIG_PATH = APP_DIR / "config.yaml"
 TEMPLATES_DIR = APP_DIR / "templates"
 STATIC_DIR = APP_DIR / "static"
@@ -29,31 +37,88 @@ STATIC_DIR = APP_DIR / "static"
 # Shift for backend buckets (disabled; we shift only cells on frontend)
 SHIFT_HOURS = 0
 
+# Max probes in flight at once (per-host limit is set on the connector)
+PROBE_CONCURRENCY = 32
+_probe_sem: Optional[asyncio.Semaphore] = None
 
-async def checker_loop() -> None:
+# Serialized /api/uptime answers: period -> (monotonic time, body); dropped whenever a round is stored
+_uptime_cache: Dict[str, Tuple[float, bytes]] = {}
+# Bumped on every stored round; a body built across a bump is stale and is not cached
+_uptime_gen = 0
+
+
+def _msk_offset() -> int:
+	"""UTC offset of Europe/Moscow in seconds; fixed UTC+3 (no DST since 2014), also without tzdata."""
+	try:
+		return int(dt.datetime.now(ZoneInfo("Europe/Moscow")).utcoffset().total_seconds())
+	except Exception:
+		return 3 * 3600
+
+
+# Buckets are aligned to MSK midnight so a coarse bucket never straddles two days
+BUCKET_OFFSET = _msk_offset()
+
+# Per-server bucketing is done by SQLite over the (server, ts, ok) covering index
+BUCKETS_SQL = """
+	SELECT server, (ts + :offset) / :step * :step - :offset AS bucket, SUM(ok), COUNT(*)
+	FROM checks
+	WHERE server = :server AND ts >= :since
+	GROUP BY bucket
+"""
+
+
+async def checker_loop(session: aiohttp.ClientSession) -> None:
 	await asyncio.sleep(0.2)
-	async with aiohttp.ClientSession() as session:
-		while True:
-			start_ts = int(dt.datetime.utcnow().timestamp())
-			tasks = [check_once(session, s) for s in CONFIG.servers]
-			results = await asyncio.gather(*tasks, return_exceptions=False)
-			write_tasks = [append_check_result(name, ok, start_ts) for name, ok in results]
-			await asyncio.gather(*write_tasks)
-			await asyncio.sleep(max(1, CONFIG.check_interval_seconds))
+	interval = max(1, CONFIG.check_interval_seconds)
+	loop = asyncio.get_running_loop()
+	# rounds start on a fixed schedule, so slow probes don't make the period drift
+	next_t = loop.time()
+	while True:
+		start_ts = int(time.time())
+		results: List[Tuple[str, bool]] = []
+		for probe in asyncio.as_completed([check_once(session, s) for s in CONFIG.servers]):
+			name, ok = await probe
+			remember_check(name, ok, start_ts)
+			results.append((name, ok))
+		await asyncio.to_thread(_append_many, results, start_ts)
+		next_t += interval
+		if loop.time() - next_t > 2 * interval:
+			# fell far behind (suspend, overload): resync instead of firing a burst of rounds
+			next_t = loop.time()
+		await asyncio.sleep(max(0.0, next_t - loop.time()))
 
 
 # Lifespan handler to replace deprecated on_event
 async def lifespan(app: FastAPI):
+	global _probe_sem, DB
 	TEMPLATES_DIR.mkdir(parents=True, exist_ok=True)
 	STATIC_DIR.mkdir(parents=True, exist_ok=True)
 	DATA_DIR.mkdir(parents=True, exist_ok=True)
-	bg_task = asyncio.create_task(checker_loop())
+	DB = await asyncio.to_thread(open_db)
+	await asyncio.to_thread(_import_legacy_ndjson)
+	await asyncio.to_thread(_load_recent)
+	# one keep-alive session for all probes, so each check reuses a warm TCP/TLS connection;
+	# _probe_sem is the only cap, a probe never waits in the pool and burns its timeout there
+	app.state.session = aiohttp.ClientSession(
+		connector=aiohttp.TCPConnector(
+			limit=0,
+			limit_per_host=0,
+			keepalive_timeout=75,
+			ttl_dns_cache=300,
+			enable_cleanup_closed=True,
+		),
+	)
+	_probe_sem = asyncio.Semaphore(PROBE_CONCURRENCY)
+	bg_task = asyncio.create_task(checker_loop(app.state.session))
 	try:
 		yield
 	finally:
 		bg_task.cancel()
 		with suppress(asyncio.CancelledError):
 			await bg_task
+		await app.state.session.close()
+		with DB_LOCK:
+			DB.close()
 
 
 app = FastAPI(title="Uptime Dashboard", lifespan=lifespan)
@@ -61,68 +126,152 @@ app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
 
 
-class Config:
-	servers: List[Dict[str, str]]
-	check_interval_seconds: int
-	request_timeout_seconds: int
-
-	@classmethod
-	def load(cls) -> "Config":
-		with open(CONFIG_PATH, "r", encoding="utf-8") as f:
-			raw = yaml.safe_load(f)
-		cfg = Config()
-		cfg.servers = raw.get("servers", [])
-		cfg.check_interval_seconds = int(raw.get("check_interval_seconds", 60))
-		cfg.request_timeout_seconds = int(raw.get("request_timeout_seconds", 5))
-		return cfg
-
-
-CONFIG = Config.load()
-
-
-async def append_check_result(server_name: str, ok: bool, when: Optional[int] = None) -> None:
-	"""Append one line of JSON to the checks file."""
-	def _write() -> None:
-		DATA_DIR.mkdir(parents=True, exist_ok=True)
-		payload = {
-			"server_name": server_name,
-			"ts_utc": when or int(dt.datetime.utcnow().timestamp()),
-			"ok": 1 if ok else 0,
-		}
-		line = json.dumps(payload, ensure_ascii=False)
-		with open(DATA_FILE, "a", encoding="utf-8") as f:
-			f.write(line + "\n")
-	await asyncio.to_thread(_write)
-
-
-async def read_rows_since(since: int) -> List[Tuple[str, int, int]]:
-	"""Read checks from file, keeping only entries newer than 'since'."""
-	if not DATA_FILE.exists():
-		return []
-	def _read() -> List[Tuple[str, int, int]]:
-		rows: List[Tuple[str, int, int]] = []
-		with open(DATA_FILE, "r", encoding="utf-8") as f:
-			for line in f:
-				line = line.strip()
-				if not line:
-					continue
-				try:
-					obj = json.loads(line)
-					if int(obj.get("ts_utc", 0)) >= since:
-						rows.append((str(obj.get("server_name")), int(obj.get("ts_utc", 0)), int(obj.get("ok", 0))))
-				except Exception:
-					# пропускаем битые строки
-					continue
+class Server(msgspec.Struct, frozen=True):
+	name: str
+	url: str
+	# GET by default; HEAD for endpoints where the status line is enough
+	method: Literal["GET", "HEAD"] = "GET"
+
+
+class Config(msgspec.Struct, frozen=True):
+	servers: Tuple[Server, ...] = ()
+	check_interval_seconds: int = 60
+	request_timeout_seconds: int = 5
+
+
+# validated once at import; the frozen structs need no coercion afterwards
+CONFIG = msgspec.yaml.decode(CONFIG_PATH.read_bytes(), type=Config)
+SERVER_NAMES: Tuple[str, ...] = tuple(s.name for s in CONFIG.servers)
+# position in config, used as row index in bucket matrices
+SERVER_INDEX: Dict[str, int] = {name: i for i, name in enumerate(SERVER_NAMES)}
+# dead hosts fail on connect within a second; only a slow response uses the full budget.
+# total also counts any wait for a pooled connection, so the connector must not cap below _probe_sem
+PROBE_TIMEOUT = aiohttp.ClientTimeout(
+	total=CONFIG.request_timeout_seconds + 1,
+	sock_connect=1.0,
+	sock_read=CONFIG.request_timeout_seconds,
+)
+
+# Hot copy of the last RECENT_SECONDS of checks per server: deque of (ts_utc, ok); serves the day view
+RECENT_SECONDS = 24 * 3600
+RECENT: Dict[str, Deque[Tuple[int, int]]] = {name: deque() for name in SERVER_NAMES}
+
+
+def remember_check(name: str, ok: bool, when: int) -> None:
+	"""Add a check to the in-memory window, dropping samples older than RECENT_SECONDS."""
+	recent = RECENT.get(name)
+	if recent is None:
+		return
+	recent.append((when, 1 if ok else 0))
+	horizon = when - RECENT_SECONDS
+	while recent and recent[0][0] < horizon:
+		recent.popleft()
+
+
+def open_db() -> sqlite3.Connection:
+	DATA_DIR.mkdir(parents=True, exist_ok=True)
+	conn = sqlite3.connect(DB_FILE, check_same_thread=False, isolation_level=None)
+	conn.execute("PRAGMA journal_mode=WAL")
+	conn.execute("PRAGMA synchronous=NORMAL")
+	conn.execute("CREATE TABLE IF NOT EXISTS checks(server TEXT NOT NULL, ts INTEGER NOT NULL, ok INTEGER NOT NULL)")
+	conn.execute("CREATE INDEX IF NOT EXISTS checks_server_ts ON checks(server, ts, ok)")
+	return conn
+
+
+# Opened once in lifespan and shared by worker threads (asyncio.to_thread), one statement at a time
+DB: Optional[sqlite3.Connection] = None
+DB_LOCK = threading.Lock()
+# Hour of the last forced WAL checkpoint. With synchronous=NORMAL commits are fsynced at checkpoints;
+# SQLite also auto-checkpoints every 1000 WAL pages, the hourly one only caps unsynced time at an hour
+_synced_hour = 0
+
+
+def _insert_rows(rows: List[Tuple[str, int, int]]) -> None:
+	"""Insert rows in one explicit transaction (autocommit would commit per row). Caller holds DB_LOCK."""
+	DB.execute("BEGIN")
+	try:
+		DB.executemany("INSERT INTO checks(server, ts, ok) VALUES(?, ?, ?)", rows)
+	except BaseException:
+		DB.execute("ROLLBACK")
+		raise
+	DB.execute("COMMIT")
+
+
+def _append_many(results: List[Tuple[str, bool]], when: int) -> None:
+	"""Store a whole round atomically."""
+	global _synced_hour, _uptime_gen
+	if not results:
+		return
+	with DB_LOCK:
+		_insert_rows([(name, when, 1 if ok else 0) for name, ok in results])
+		if when // 3600 != _synced_hour:
+			DB.execute("PRAGMA wal_checkpoint(PASSIVE)")
+			_synced_hour = when // 3600
+		_uptime_gen += 1
+		_uptime_cache.clear()
+
+
+def _import_legacy_ndjson() -> None:
+	"""Import checks.ndjson of the file-based storage if the database is still empty."""
+	if not LEGACY_DATA_FILE.exists():
+		return
+	with DB_LOCK:
+		if DB.execute("SELECT 1 FROM checks LIMIT 1").fetchone() is not None:
+			return
+	rows: List[Tuple[str, int, int]] = []
+	for line in LEGACY_DATA_FILE.read_bytes().splitlines():
+		if not line:
+			continue
+		try:
+			obj = orjson.loads(line)
+			rows.append((obj["server_name"], obj["ts_utc"], obj["ok"]))
+		except Exception:
+			# пропускаем битые строки
+			continue
+	# all or nothing: an interrupted import leaves the database empty, so the next start retries it
+	with DB_LOCK:
+		DB.execute("BEGIN")
+		try:
+			if DB.execute("SELECT 1 FROM checks LIMIT 1").fetchone() is None:
+				DB.executemany("INSERT INTO checks(server, ts, ok) VALUES(?, ?, ?)", rows)
+		except BaseException:
+			DB.execute("ROLLBACK")
+			raise
+		DB.execute("COMMIT")
+
+
+def _load_recent() -> None:
+	"""Fill the in-memory window from the database (startup only)."""
+	since = int(time.time()) - RECENT_SECONDS
+	with DB_LOCK:
+		rows = DB.execute("SELECT server, ts, ok FROM checks WHERE ts >= ? ORDER BY ts", (since,)).fetchall()
+	for server, ts, ok in rows:
+		recent = RECENT.get(server)
+		if recent is not None:
+			recent.append((ts, ok))
+
+
+def bucket_start(ts: int, step: int) -> int:
+	"""Start (UTC epoch) of the 'step'-sized bucket containing ts, aligned to MSK midnight."""
+	return (ts + BUCKET_OFFSET) // step * step - BUCKET_OFFSET
+
+
+async def read_buckets_since(step: int, since: int) -> List[Tuple[str, int, int, int]]:
+	"""Aggregate checks newer than 'since' into (server, bucket, ok, total) rows of 'step' seconds."""
+	def _select() -> List[Tuple[str, int, int, int]]:
+		rows: List[Tuple[str, int, int, int]] = []
+		with DB_LOCK:
+			for name in SERVER_NAMES:
+				params = {"offset": BUCKET_OFFSET, "step": step, "server": name, "since": since}
+				rows.extend(DB.execute(BUCKETS_SQL, params).fetchall())
 		return rows
-	return await asyncio.to_thread(_read)
+	return await asyncio.to_thread(_select)
 
 
-async def check_once(session: aiohttp.ClientSession, server: Dict[str, str]) -> Tuple[str, bool]:
-	name = server["name"]
-	url = server["url"]
+async def check_once(session: aiohttp.ClientSession, server: Server) -> Tuple[str, bool]:
+	name, url = server.name, server.url
 	try:
-		timeout = aiohttp.ClientTimeout(total=CONFIG.request_timeout_seconds)
-		async with session.get(url, timeout=timeout) as resp:
+		async with _probe_sem, session.request(server.method, url, timeout=PROBE_TIMEOUT) as resp:
 			ok = 200 <= resp.status < 300
 			return name, ok
 	except Exception:
@@ -131,11 +280,13 @@ async def check_once(session: aiohttp.ClientSession, server: Dict[str, str]) ->
 
 async def run_one_round(when_ts: Optional[int] = None) -> List[Tuple[str, bool]]:
 	"""Run one check round for all servers and persist results."""
-	async with aiohttp.ClientSession() as session:
-		results = await asyncio.gather(*[check_once(session, s) for s in CONFIG.servers])
-		when = when_ts or int(dt.datetime.utcnow().timestamp())
-		await asyncio.gather(*[append_check_result(n, ok, when) for n, ok in results])
-		return results
+	session: aiohttp.ClientSession = app.state.session
+	results = await asyncio.gather(*[check_once(session, s) for s in CONFIG.servers])
+	when = when_ts or int(time.time())
+	for name, ok in results:
+		remember_check(name, ok, when)
+	await asyncio.to_thread(_append_many, results, when)
+	return results
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -150,101 +301,97 @@ async def index(request: Request) -> Any:
 
 
 def period_to_seconds(period: str) -> int:
+	"""Length of a period, in whole MSK days ending with today."""
 	if period == "day":
 		return 24 * 3600
 	if period == "week":
 		return 7 * 24 * 3600
-	if period == "month":
-		return 30 * 24 * 3600
-	raise ValueError("invalid period")
-
-
-@app.get("/api/uptime")
-async def api_uptime(period: str = "day") -> JSONResponse:
-	# Moscow timezone for all calculations
-	msk = ZoneInfo("Europe/Moscow") if ZoneInfo is not None else None
-	if msk is None:
-		# fallback (UTC window)
-		now = int(dt.datetime.utcnow().timestamp())
-		window = period_to_seconds(period)
-		since = now - window
-		rows = await read_rows_since(since)
-		buckets: Dict[str, Dict[int, List[int]]] = {}
-		for server in [s["name"] for s in CONFIG.servers]:
-			buckets[server] = {}
-		for server_name, ts_utc, ok in rows:
-			hour_bucket = (ts_utc // 3600) * 3600
-			buckets.setdefault(server_name, {}).setdefault(hour_bucket, []).append(int(ok))
-		start_hour = (since // 3600) * 3600
-		end_exclusive = start_hour + window
-		result: Dict[str, Any] = {}
-		for server in buckets.keys():
-			series = []
-			total_ok = 0
-			total = 0
-			for h in range(start_hour, end_exclusive, 3600):
-				vals = buckets[server].get(h, [])
-				hour_total = len(vals)
-				hour_ok = sum(vals)
-				pct = (hour_ok / hour_total) if hour_total else None
-				series.append({"hour": h, "ok_ratio": pct})
-				total_ok += hour_ok
-				total += hour_total
-			uptime_pct = (total_ok / total * 100.0) if total else None
-			result[server] = {"series": series, "uptime_percent": uptime_pct}
-		return JSONResponse(result)
-
-	# MSK-aware path
-	now_msk = dt.datetime.now(msk)
+	return 30 * 24 * 3600
+
+
+def period_to_step(period: str) -> int:
+	"""Bucket size used to render a period: hours for a day, 6h for a week, days for a month."""
 	if period == "day":
-		start_msk = now_msk.replace(hour=0, minute=0, second=0, microsecond=0)
-		hours = 24
-	elif period == "week":
-		start_msk = (now_msk - dt.timedelta(days=6)).replace(hour=0, minute=0, second=0, microsecond=0)
-		hours = 7 * 24
-	else:  # month
-		start_msk = (now_msk - dt.timedelta(days=29)).replace(hour=0, minute=0, second=0, microsecond=0)
-		hours = 30 * 24
-
-	# read only needed rows since the first bucket in UTC
-	first_bucket_utc = int(start_msk.astimezone(dt.timezone.utc).timestamp())
-	rows = await read_rows_since(first_bucket_utc)
-
-	# group rows into UTC hour buckets
-	buckets: Dict[str, Dict[int, List[int]]] = {}
-	for server in [s["name"] for s in CONFIG.servers]:
-		buckets[server] = {}
-	for server_name, ts_utc, ok in rows:
-		hour_bucket = (ts_utc // 3600) * 3600
-		buckets.setdefault(server_name, {}).setdefault(hour_bucket, []).append(int(ok))
-
-	# build MSK-ordered series
+		return 3600
+	if period == "week":
+		return 6 * 3600
+	return 24 * 3600
+
+
+@app.get("/api/uptime", response_class=Response)
+async def api_uptime(period: str = "day") -> Response:
+	if period not in ("day", "week"):
+		# anything else renders the month view; keep one cache entry for it
+		period = "month"
+	# the answer only changes when a round completes, so serve it from cache until then
+	now = time.monotonic()
+	hit = _uptime_cache.get(period)
+	if hit is not None and now - hit[0] < CONFIG.check_interval_seconds:
+		return Response(hit[1], media_type="application/json")
+	gen = _uptime_gen
+	body = orjson.dumps(await build_uptime(period))
+	if gen == _uptime_gen:
+		_uptime_cache[period] = (now, body)
+	return Response(body, media_type="application/json")
+
+
+def build_series(rows: List[Tuple[str, int, int, int]], starts: Sequence[int]) -> Dict[str, Any]:
+	"""Render per-server series over the given bucket starts (UTC epochs, ascending)."""
+	names = SERVER_NAMES
+	name_idx = SERVER_INDEX
+	n = len(rows)
+	sidx = np.fromiter((name_idx.get(r[0], -1) for r in rows), dtype=np.int64, count=n)
+	ts_arr = np.fromiter((r[1] for r in rows), dtype=np.int64, count=n)
+	ok_arr = np.fromiter((r[2] for r in rows), dtype=np.int64, count=n)
+	tot_arr = np.fromiter((r[3] for r in rows), dtype=np.int64, count=n)
+
+	grid = np.asarray(starts, dtype=np.int64)
+	hidx = np.searchsorted(grid, ts_arr, side="right") - 1
+	mask = (sidx >= 0) & (hidx >= 0)
+	mask &= grid[np.clip(hidx, 0, None)] == ts_arr
+
+	ok = np.zeros((len(names), len(grid)), dtype=np.int64)
+	tot = np.zeros_like(ok)
+	np.add.at(ok, (sidx[mask], hidx[mask]), ok_arr[mask])
+	np.add.at(tot, (sidx[mask], hidx[mask]), tot_arr[mask])
+
+	# all arithmetic stays on the (server, bucket) matrices; empty buckets are NaN -> null in orjson
+	ratio = np.divide(ok, tot, out=np.full(ok.shape, np.nan), where=tot > 0)
+	ok_sum = ok.sum(axis=1)
+	tot_sum = tot.sum(axis=1)
+	uptime_pct = np.divide(ok_sum * 100.0, tot_sum, out=np.full(len(names), np.nan), where=tot_sum > 0)
+
+	hours = grid.tolist()
 	result: Dict[str, Any] = {}
-	for server in buckets.keys():
-		series = []
-		total_ok = 0
-		total = 0
-		for i in range(hours):
-			h_msk = start_msk + dt.timedelta(hours=i)
-			h_utc = h_msk.astimezone(dt.timezone.utc)
-			h_bucket = int(h_utc.timestamp())
-			vals = buckets[server].get(h_bucket, [])
-			hour_total = len(vals)
-			hour_ok = sum(vals)
-			pct = (hour_ok / hour_total) if hour_total else None
-			series.append({"hour": h_bucket, "ok_ratio": pct})
-			total_ok += hour_ok
-			total += hour_total
-		uptime_pct = (total_ok / total * 100.0) if total else None
-		result[server] = {"series": series, "uptime_percent": uptime_pct}
-
-	return JSONResponse(result)
-
-
-@app.post("/api/force-check")
-async def api_force_check() -> JSONResponse:
+	for server, ratio_row, pct in zip(names, ratio.tolist(), uptime_pct.tolist()):
+		series = [{"hour": h_bucket, "ok_ratio": r} for h_bucket, r in zip(hours, ratio_row)]
+		result[server] = {"series": series, "uptime_percent": pct}
+	return result
+
+
+async def build_uptime(period: str) -> Dict[str, Any]:
+	# MSK is a fixed offset, so calendar days are plain integer arithmetic on UTC epochs
+	step = period_to_step(period)
+	window = period_to_seconds(period)
+	today_utc = bucket_start(int(time.time()), 24 * 3600)
+	start = today_utc + 24 * 3600 - window
+	if window <= RECENT_SECONDS:
+		# day view: bucket the in-memory window, no disk I/O (repeated buckets are summed)
+		rows = [
+			(name, bucket_start(ts, step), ok, 1)
+			for name, recent in RECENT.items()
+			for ts, ok in recent
+			if ts >= start
+		]
+	else:
+		rows = await read_buckets_since(step, start)
+	return build_series(rows, range(start, start + window, step))
+
+
+@app.post("/api/force-check", response_class=ORJSONResponse)
+async def api_force_check() -> ORJSONResponse:
 	results = await run_one_round()
-	return JSONResponse({"ok": True, "results": [{"server": n, "ok": ok} for n, ok in results]})
+	return ORJSONResponse({"ok": True, "results": [{"server": n, "ok": ok} for n, ok in results]})
 
 
 if __name__ == "__main__":